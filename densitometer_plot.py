@@ -1,44 +1,176 @@
 import argparse
+import functools
+import math
+import matplotlib
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
-from scipy.stats import linregress
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+_LOG10_2 = math.log10(2.0)
+
+# Number of consecutive points searched for the contrast index
+WINDOW_SIZE = 11
+
+# Options for saving plots to file
+SAVEFIG_OPTIONS = dict(dpi=100, bbox_inches='tight')
+
+# Columns of the manifest CSV read by main_batch
+MANIFEST_COLUMNS = ['step_wedge', 'film', 'ev', 'exposure_time', 'name', 'dmin', 'dmax']
+
+# Minor tick positions within each decade of the log axis
+_SUBS = np.arange(2, 10)
 
 def calculate_log_e(ev, exposure_time):
     """Calculate Log E from EV and exposure time"""
-    lux = 2.5 * (2 ** ev)
-    return np.log10(lux * 1000 * exposure_time)
+    # log10(2.5 * 2**ev * 1000 * t), split up so it stays in scalar math
+    return math.log10(2500.0 * exposure_time) + ev * _LOG10_2
+
+def _monotonic_direction(values):
+    """Return 1 if values are non-decreasing, -1 if non-increasing, 0 otherwise"""
+    diffs = np.diff(values)
+    if np.all(diffs >= 0):
+        return 1
+    if np.all(diffs <= 0):
+        return -1
+    return 0
+
+def _window_r_values(log_x, y, window_size):
+    """Pearson r of log_x against y for every window of window_size consecutive points"""
+    def window_sums(values):
+        prefix = np.concatenate(([0.0], np.cumsum(values)))
+        return prefix[window_size:] - prefix[:-window_size]
+
+    # Zero out non-finite points (x <= 0 before log10) so they don't poison the
+    # running sums, and skip every window that contains one
+    finite = np.isfinite(log_x) & np.isfinite(y)
+    log_x = np.where(finite, log_x, 0.0)
+    y = np.where(finite, y, 0.0)
+    all_finite = window_sums(~finite) == 0
+
+    n = window_size
+    sum_x = window_sums(log_x)
+    sum_y = window_sums(y)
+    sum_xx = window_sums(log_x * log_x)
+    sum_yy = window_sums(y * y)
+    sum_xy = window_sums(log_x * y)
+
+    cov = n * sum_xy - sum_x * sum_y
+    denom = np.sqrt(np.clip((n * sum_xx - sum_x ** 2) * (n * sum_yy - sum_y ** 2), 0, None))
 
-def calculate_contrast_index(x_values, y_values, window_size=11):
-    """Calculate contrast index using sliding window to find most linear portion in log scale"""
-    if len(x_values) < window_size or len(y_values) < window_size:
-        print(f"Warning: Not enough data points. Need at least {window_size} points")
+    # Windows with no spread in x or y get r = 0, matching linregress
+    r_values = np.zeros_like(cov)
+    np.divide(cov, denom, out=r_values, where=(denom > 0) & all_finite)
+    return np.clip(r_values, -1.0, 1.0)
+
+def _best_window_numpy(log_x, y, window_size):
+    """Start index and r value of the window with the highest |r|"""
+    r_values = _window_r_values(log_x, y, window_size)
+    i = int(np.argmax(np.abs(r_values)))
+    return i, r_values[i]
+
+if njit is not None:
+    @njit(cache=True)
+    def _best_window(log_x, y, window_size):
+        """Start index and r value of the window with the highest |r|, using rolling sums"""
+        # Zero out non-finite points (x <= 0 before log10) so they don't poison
+        # the running sums, and skip every window that contains one
+        m = len(log_x)
+        finite = np.empty(m, dtype=np.bool_)
+        xs = np.empty(m)
+        ys = np.empty(m)
+        for k in range(m):
+            finite[k] = np.isfinite(log_x[k]) and np.isfinite(y[k])
+            xs[k] = log_x[k] if finite[k] else 0.0
+            ys[k] = y[k] if finite[k] else 0.0
+
+        n = window_size
+        sum_x = sum_y = sum_xx = sum_yy = sum_xy = 0.0
+        non_finite = 0
+        for j in range(n):
+            sum_x += xs[j]
+            sum_y += ys[j]
+            sum_xx += xs[j] * xs[j]
+            sum_yy += ys[j] * ys[j]
+            sum_xy += xs[j] * ys[j]
+            if not finite[j]:
+                non_finite += 1
+
+        best_i = 0
+        best_r = 0.0
+        for i in range(m - n + 1):
+            if i > 0:
+                add_x, rem_x = xs[i+n-1], xs[i-1]
+                add_y, rem_y = ys[i+n-1], ys[i-1]
+                if not finite[i+n-1]:
+                    non_finite += 1
+                if not finite[i-1]:
+                    non_finite -= 1
+                sum_x += add_x - rem_x
+                sum_y += add_y - rem_y
+                sum_xx += add_x * add_x - rem_x * rem_x
+                sum_yy += add_y * add_y - rem_y * rem_y
+                sum_xy += add_x * add_y - rem_x * rem_y
+
+            if non_finite:
+                continue
+            cov = n * sum_xy - sum_x * sum_y
+            var = (n * sum_xx - sum_x * sum_x) * (n * sum_yy - sum_y * sum_y)
+            r = cov / np.sqrt(var) if var > 0 else 0.0
+            r = min(max(r, -1.0), 1.0)
+            if abs(r) > abs(best_r):
+                best_i = i
+                best_r = r
+        return best_i, best_r
+
+    # Compile at import so the first plot doesn't pay for it
+    _best_window(np.arange(1.0, 3.0), np.arange(1.0, 3.0), 2)
+else:
+    _best_window = _best_window_numpy
+
+def _warn_not_enough_points(window_size):
+    print(f"Warning: Not enough data points. Need at least {window_size} points")
+
+def calculate_contrast_index(log_x_values, y_values, window_size=WINDOW_SIZE):
+    """Calculate contrast index using sliding window to find most linear portion in log scale
+
+    Takes the x values already converted to log10 so callers can compute them once.
+    """
+    if len(log_x_values) < window_size or len(y_values) < window_size:
+        _warn_not_enough_points(window_size)
         return None, None
         
     best_r_value = 0
     best_points = None
     
-    # Convert to numpy arrays and ensure they're sorted by x values
-    x = np.array(x_values)
-    y = np.array(y_values)
-    sort_idx = np.argsort(x)
-    x = x[sort_idx]
-    y = y[sort_idx]
-    
-    # Convert x values to log scale for finding linear portion
-    log_x = np.log10(x)
+    # Ensure the points are sorted by x values, skipping the sort when they already are
+    direction = _monotonic_direction(log_x_values)
+    if direction > 0:
+        log_x, y = log_x_values, y_values
+    elif direction < 0:
+        log_x, y = log_x_values[::-1], y_values[::-1]
+    else:
+        sort_idx = np.argsort(log_x_values)
+        log_x = log_x_values[sort_idx]
+        y = y_values[sort_idx]
     
-    for i in range(len(x) - window_size + 1):
-        window_log_x = log_x[i:i+window_size]
-        window_y = y[i:i+window_size]
-        
-        # Calculate linear regression in log space
-        _, _, r_value, _, _ = linregress(window_log_x, window_y)
-        
-        # Update if this window has better linearity
-        if abs(r_value) > abs(best_r_value):
-            best_r_value = r_value
-            best_points = (x[i], y[i], x[i+window_size-1], y[i+window_size-1])
+    # Find the most linear window in log space. r doesn't change when the data
+    # is shifted, so center it to keep the running sums of squares small and
+    # avoid cancellation in n*Sxx - Sx**2. The means are taken over finite
+    # points only; windows with non-finite points are skipped by the search.
+    finite = np.isfinite(log_x) & np.isfinite(y)
+    if finite.any():
+        log_x_mean, y_mean = log_x[finite].mean(), y[finite].mean()
+    else:
+        log_x_mean = y_mean = 0.0
+    i, best_r_value = _best_window(log_x - log_x_mean, y - y_mean, window_size)
+    if best_r_value:
+        j = i + window_size - 1
+        best_points = (10 ** log_x[i], y[i], 10 ** log_x[j], y[j])
     
     if best_points and abs(best_r_value) > 0.98:
         logexp_a, density_a = best_points[0], best_points[1]
@@ -51,14 +183,38 @@ def calculate_contrast_index(x_values, y_values, window_size=11):
     print("Could not find a suitable linear region with 5 points (R² > 0.98)")
     return None, None
 
+def _closest_index(values, target, direction):
+    """Index of the value closest to target, by binary search when values are monotonic
+
+    Matches np.abs(values - target).argmin(): ties and repeated values resolve
+    to the first index in the original order.
+    """
+    if direction == 0:
+        return int(np.abs(values - target).argmin())
+    ascending = values if direction > 0 else values[::-1]
+    i = int(np.searchsorted(ascending, target))
+    if i == len(ascending):
+        i -= 1
+    elif i > 0:
+        below, above = target - ascending[i-1], ascending[i] - target
+        # On a tie the smaller value comes first in ascending data, the larger in descending
+        if below < above or (below == above and direction > 0):
+            i -= 1
+    if direction > 0:
+        return int(np.searchsorted(ascending, ascending[i], side='left'))
+    # Last occurrence in the reversed view is the first in the original order
+    i = int(np.searchsorted(ascending, ascending[i], side='right')) - 1
+    return len(values) - 1 - i
+
 def calculate_average_gradient(x_values, y_values, dmin):
     """Calculate average gradient between Dmin+0.1 and Dmin+0.6"""
     lower_density = dmin + 0.1
     upper_density = dmin + 0.6
 
     # Find closest indices
-    idx1 = np.abs(y_values - lower_density).argmin()
-    idx2 = np.abs(y_values - upper_density).argmin()
+    direction = _monotonic_direction(y_values)
+    idx1 = _closest_index(y_values, lower_density, direction)
+    idx2 = _closest_index(y_values, upper_density, direction)
 
     if idx1 == idx2:
         print("Warning: Could not find two distinct points for average gradient.")
@@ -71,10 +227,28 @@ def calculate_average_gradient(x_values, y_values, dmin):
 
     return grad
 
-def plot_densitometry(step_wedge_file, test_film_file, ev, exposure_time, name, dmin, dmax):
-    # Read the CSV files
-    step_wedge = pd.read_csv(step_wedge_file)
-    test_film = pd.read_csv(test_film_file)
+@functools.lru_cache(maxsize=None)
+def _load_density(path):
+    """Read the density column of a CSV file, cached per path"""
+    density = pd.read_csv(path, usecols=['density'], dtype={'density': np.float64}, engine='c')['density'].to_numpy()
+    # The cached array is shared between callers, so keep it read-only
+    density.flags.writeable = False
+    return density
+
+def plot_densitometry(step_wedge_file, test_film_file, ev, exposure_time, name, dmin, dmax, ax=None, output=None,
+                      simple=False):
+    """Plot the characteristic curve of a test film
+
+    If ax is given the plot is drawn into it, clearing it first, and left for
+    the caller to save or show. Otherwise a new figure is created and saved
+    to output and closed if output is given, or shown.
+
+    With simple=True the speed point is taken from the closest measurement
+    instead of being interpolated, and the average gradient is skipped.
+    """
+    # Read the density column of the CSV files
+    step_wedge = _load_density(step_wedge_file)
+    test_film = _load_density(test_film_file)
     
     # Calculate Log E
     log_e = calculate_log_e(ev, exposure_time)
@@ -83,11 +257,16 @@ def plot_densitometry(step_wedge_file, test_film_file, ev, exposure_time, name,
     min_measurements = min(len(step_wedge), len(test_film))
     
     # Calculate x-axis values (Log E - step wedge measurements)
-    x_values = log_e - step_wedge['density'].iloc[:min_measurements]
-    y_values = test_film['density'].iloc[:min_measurements]
+    x_values = log_e - step_wedge[:min_measurements]
+    y_values = test_film[:min_measurements]
     
     # Calculate contrast index
-    contrast_index, best_points = calculate_contrast_index(x_values, y_values)
+    if min_measurements < WINDOW_SIZE:
+        _warn_not_enough_points(WINDOW_SIZE)
+        contrast_index, best_points = None, None
+    else:
+        log_x_values = np.log10(x_values)
+        contrast_index, best_points = calculate_contrast_index(log_x_values, y_values)
 
     # Print info about measurements
     print(f"Step wedge measurements: {len(step_wedge)}")
@@ -97,41 +276,49 @@ def plot_densitometry(step_wedge_file, test_film_file, ev, exposure_time, name,
     if dmin:
         min_density = dmin
     else:
-        min_density = min(y_values)
+        min_density = y_values.min()
     target_density = min_density + 0.1
     
-    above = np.where(y_values >= target_density)[0]
-    below = np.where(y_values < target_density)[0]
+    # Bracket the target density; searchsorted needs densities in ascending order
+    x_arr, y_arr = x_values, y_values
+    if y_arr[0] > y_arr[-1]:
+        x_arr, y_arr = x_arr[::-1], y_arr[::-1]
+    idx = np.searchsorted(y_arr, target_density)
 
-    if len(above) > 0 and len(below) > 0:
-        idx_above = above[0]
-        idx_below = below[-1]
+    if not simple and 0 < idx < len(y_arr):
         # Linear interpolation
-        x1, y1 = x_values[idx_below], y_values[idx_below]
-        x2, y2 = x_values[idx_above], y_values[idx_above]
+        x1, y1 = x_arr[idx-1], y_arr[idx-1]
+        x2, y2 = x_arr[idx], y_arr[idx]
         if x2 != x1:
             log_e_at_target = x1 + (target_density - y1) * (x2 - x1) / (y2 - y1)
         else:
             log_e_at_target = x1  # fallback if points are the same
     else:
         # Fallback to closest if interpolation is not possible
-        closest_idx = np.abs(y_values - target_density).argmin()
-        log_e_at_target = x_values[closest_idx]
+        closest_idx = np.abs(y_arr - target_density).argmin()
+        log_e_at_target = x_arr[closest_idx]
     
     # Calculate ISO speed: 800/10^LogE
     iso_speed = int(800 / (10 ** log_e_at_target))
     
     # Calculate average gradient
-    avg_grad = calculate_average_gradient(x_values, y_values, min_density)
-
-    if avg_grad:
-        iso_ok = 0.62 <= avg_grad <= 0.70
-        print(f"Average Gradient: {avg_grad:.3f} ({'OK' if iso_ok else 'Out of ISO Range 0.62-0.70'})")
+    if simple:
+        avg_grad = None
     else:
-        print("Could not calculate average gradient.")
+        avg_grad = calculate_average_gradient(x_values, y_values, min_density)
+        if avg_grad:
+            iso_ok = 0.62 <= avg_grad <= 0.70
+            print(f"Average Gradient: {avg_grad:.3f} ({'OK' if iso_ok else 'Out of ISO Range 0.62-0.70'})")
+        else:
+            print("Could not calculate average gradient.")
 
-    # Create the plot
-    fig, ax = plt.subplots(figsize=(14, 10))
+    # Create the plot, or reuse the given axes
+    new_figure = ax is None
+    if new_figure:
+        fig, ax = plt.subplots(figsize=(14, 10))
+    else:
+        fig = ax.figure
+        ax.clear()
     
     # Add a marker for the ISO speed point (speed point)
     ax.scatter([log_e_at_target], [target_density], color='orange', s=100, zorder=5, label='ISO Speed Point')
@@ -145,64 +332,101 @@ def plot_densitometry(step_wedge_file, test_film_file, ev, exposure_time, name,
     min_grad = 0.62
     max_grad = 0.70
 
-    if avg_grad < min_grad:
-        grad_status = "Too Low"
-    elif avg_grad > max_grad:
-        grad_status = "Too High"
-    else:
-        grad_status = "OK"
+    grad_text = ''
+    if avg_grad:
+        if avg_grad < min_grad:
+            grad_status = "Too Low"
+        elif avg_grad > max_grad:
+            grad_status = "Too High"
+        else:
+            grad_status = "OK"
+        grad_text = f'    Avg. Gradient: {avg_grad:.2f} ({grad_status})'
 
-    # Add contrast index and ISO speed values below the graph
+    # Add contrast index and ISO speed values below the graph. The text is
+    # owned by the axes so that clearing them for the next plot removes it.
     if contrast_index and best_points:
-        plt.figtext(0.5, 0.05, 
-                    f'Contrast Index: {contrast_index:.2f}    ISO Speed: {iso_speed}    Avg. Gradient: {avg_grad:.2f} ({grad_status})', 
-                    ha='center', va='center',
-                    bbox=dict(facecolor='white', alpha=0.8))
+        ax.text(0.5, 0.05, 
+                f'Contrast Index: {contrast_index:.2f}    ISO Speed: {iso_speed}{grad_text}', 
+                ha='center', va='center', transform=fig.transFigure,
+                bbox=dict(facecolor='white', alpha=0.8))
         # Plot the line segment used for contrast index
         ax.plot([best_points[0], best_points[2]], 
                 [best_points[1], best_points[3]], 
                 'r-', linewidth=2, label='Contrast Index Region')
     else:
-        plt.figtext(0.5, 0.05, 
-                   f'ISO Speed: {iso_speed}', 
-                   ha='center', va='center',
-                   bbox=dict(facecolor='white', alpha=0.8))
+        ax.text(0.5, 0.05, 
+                f'ISO Speed: {iso_speed}', 
+                ha='center', va='center', transform=fig.transFigure,
+                bbox=dict(facecolor='white', alpha=0.8))
 
 
 
-    # Set logarithmic scale for x-axis
-    plt.semilogx()
+    # Set logarithmic scale for x-axis. Locators and formatters are bound to
+    # the axis they are set on, so each plot needs its own.
+    ax.set_xscale('log')
     ax.xaxis.set_major_formatter(plt.ScalarFormatter())
     ax.xaxis.set_minor_formatter(plt.ScalarFormatter())
     ax.xaxis.set_major_locator(plt.LogLocator(base=10.0))
-    ax.xaxis.set_minor_locator(plt.LogLocator(base=10.0, subs=np.arange(2, 10)))
+    ax.xaxis.set_minor_locator(plt.LogLocator(base=10.0, subs=_SUBS))
     ax.xaxis.set_tick_params(which='minor', labelsize=8)
 
     # Ensure all tick labels are visible
     plt.setp(ax.get_xticklabels(), rotation=15, ha='right')
 
     # Customize the plot
-    plt.grid(True, which="both", ls="-", alpha=0.2)
-    plt.xlabel('Log E (lux-seconds)')
-    plt.ylabel('Density')
-    plt.title(f'Film Characteristic Curve\nEV: {ev}, Exposure Time: {exposure_time}s\n{name}')
-    plt.legend()
+    ax.grid(True, which="both", ls="-", alpha=0.2)
+    ax.set_xlabel('Log E (lux-seconds)')
+    ax.set_ylabel('Density')
+    ax.set_title(f'Film Characteristic Curve\nEV: {ev}, Exposure Time: {exposure_time}s\n{name}')
+    ax.legend()
     
     # Add density reference lines
-    plt.axhline(y=min_density, color='gray', linestyle='--', alpha=0.5, label='Toe')
+    ax.axhline(y=min_density, color='gray', linestyle='--', alpha=0.5, label='Toe')
     if (dmax):
         max_density = dmax
     else:
-        max_density = max(y_values)
-    plt.axhline(y=max_density, color='gray', linestyle='--', alpha=0.5, label='Shoulder')
+        max_density = y_values.max()
+    ax.axhline(y=max_density, color='gray', linestyle='--', alpha=0.5, label='Shoulder')
 
     # Adjust layout to make room for contrast index text
-    plt.subplots_adjust(bottom=0.15)
+    fig.subplots_adjust(bottom=0.15)
 
-    plt.show()
+    if new_figure:
+        if output:
+            fig.savefig(output, **SAVEFIG_OPTIONS)
+            plt.close(fig)
+        else:
+            plt.show()
+    return fig
+
+def main_batch(manifest_file):
+    """Plot every film listed in a manifest CSV, reusing one figure and saving each as <name>.png"""
+    manifest = pd.read_csv(manifest_file, usecols=MANIFEST_COLUMNS)
+    # Empty dmin/dmax cells mean "use the measured value"
+    manifest = manifest.astype(object).where(manifest.notna(), None)
+
+    fig, ax = plt.subplots(figsize=(14, 10))
+    for row in manifest.itertuples(index=False):
+        plot_densitometry(row.step_wedge, row.film, row.ev, row.exposure_time,
+                          row.name, row.dmin, row.dmax, ax=ax)
+        fig.savefig(f'{row.name}.png', **SAVEFIG_OPTIONS)
+        print(f"Plot saved for {row.name} with EV: {row.ev} and exposure time: {row.exposure_time}s")
+    plt.close(fig)
 
 def main():
-    parser = argparse.ArgumentParser(description='Film Densitometry Plot Generator')
+    # A manifest replaces all the single-film arguments, so look for it first
+    batch_parser = argparse.ArgumentParser(add_help=False)
+    batch_parser.add_argument('-b', '--batch', type=str, help='Path to a manifest CSV listing films to plot in one run')
+    batch_args, extra_args = batch_parser.parse_known_args()
+    if batch_args.batch:
+        if extra_args:
+            batch_parser.error(f"unrecognized arguments with --batch: {' '.join(extra_args)}")
+        # Nothing is shown, so skip loading a GUI backend
+        matplotlib.use('Agg')
+        main_batch(batch_args.batch)
+        return
+
+    parser = argparse.ArgumentParser(description='Film Densitometry Plot Generator', parents=[batch_parser])
     parser.add_argument('-ev', type=float, help='Exposure Value (EV)', required=True)
     parser.add_argument('-t', '--exposure_time', type=float, help='Exposure time in seconds', required=True)
     parser.add_argument('-s', '--step_wedge', type=str, help='Path to step wedge CSV file', required=True)
@@ -210,11 +434,17 @@ def main():
     parser.add_argument('-n', '--name', type=str, help='Name of the test film', required=True)
     parser.add_argument('-d', '--dmin', type=float, help='Minimum density value for the film', required=True)
     parser.add_argument('-dx', '--dmax', type=float, help='Minimum density value for the film', required=False)
+    parser.add_argument('--simple', action='store_true', help='Use the closest measurement for the speed point and skip the average gradient')
+    parser.add_argument('-o', '--output', type=str, help='Save the plot to this file instead of showing it', required=False)
 
     args = parser.parse_args()
+    if args.output:
+        # Nothing is shown, so skip loading a GUI backend
+        matplotlib.use('Agg')
     
     plot_densitometry(args.step_wedge, args.film, 
-                     args.ev, args.exposure_time, args.name, args.dmin, args.dmax)
+                     args.ev, args.exposure_time, args.name, args.dmin, args.dmax,
+                     output=args.output, simple=args.simple)
     print(f"Plot generated for {args.name} with EV: {args.ev} and exposure time: {args.exposure_time}s")
 
 if __name__ == "__main__":